@@ -1,28 +1,46 @@
 
 # backend/main.py
-from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Body, Query, Request
+from fastapi import FastAPI, UploadFile, File, Header, HTTPException, Body, Query, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from pathlib import Path
 from dotenv import load_dotenv
 import pandas as pd
-import json, os, math
+import json, os, math, gzip, hashlib, base64, time, random, threading, re
 from io import BytesIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 from typing import Optional, List
 from pydantic import BaseModel, Field
 import logging
 
 # ==== SQLAlchemy (PostgreSQL / Supabase) ====
-from sqlalchemy import create_engine, Column, Integer, String, Text, MetaData, text
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, LargeBinary, DateTime, MetaData, text
 from sqlalchemy.orm import sessionmaker, declarative_base, Session
 from sqlalchemy.dialects.postgresql import JSONB
 
+# ==== Serialización rápida (orjson / brotli son opcionales) ====
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 # ====== Cargar .env (solo útil en local) ======
 ENV_PATH = Path(__file__).parent / ".env"
 load_dotenv(dotenv_path=ENV_PATH)
 
 ADMIN_USER = os.getenv("ADMIN_USER") or "admin"
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD") or "Admin2025"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES") or 1024)  # bajo esto no se comprime
+GENERATIONS_KEEP = int(os.getenv("GENERATIONS_KEEP") or 5)  # generaciones de datos a conservar
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS") or 200)     # umbral de query lenta
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE") or 0.1)  # fracción con EXPLAIN
+SLOW_QUERY_BUFFER = int(os.getenv("SLOW_QUERY_BUFFER") or 50)  # queries lentas recientes en memoria
 DATABASE_URL = os.getenv("DATABASE_URL")  # <-- usa Supabase; ya NO usamos DB_PATH
 
 if not DATABASE_URL:
@@ -39,6 +57,18 @@ class Employee(Base):
     __tablename__ = "employees"
     id = Column(Integer, primary_key=True, index=True)
     data = Column(JSONB, nullable=False)  # fila completa del Excel como JSONB
+    payload = Column(LargeBinary)          # columnas visibles ya codificadas en JSON (bytes)
+    generation_id = Column(Integer, index=True)  # generación (upload) a la que pertenece la fila
+
+class DatasetGeneration(Base):
+    __tablename__ = "dataset_generations"
+    id = Column(Integer, primary_key=True, index=True)
+    file_name = Column(String)
+    rows = Column(Integer)
+    columns = Column(JSONB)           # lista de columnas del Excel
+    checksum = Column(String)         # sha256 del archivo subido
+    created_at = Column(DateTime, default=datetime.utcnow)
+    payload_visibles = Column(JSONB)  # columnas visibles con las que se precalcularon los payloads
 
 class MetaEntry(Base):
     __tablename__ = "meta"
@@ -56,9 +86,35 @@ def init_db():
     if engine is None:
         return
     Base.metadata.create_all(bind=engine)
+    # create_all no agrega columnas a tablas existentes: migración mínima.
+    # ALTER TABLE toma ACCESS EXCLUSIVE aunque la columna exista, así que solo se
+    # ejecuta si falta, y con lock_timeout para no encolar las consultas detrás.
+    with engine.begin() as conn:
+        existing = {r[0] for r in conn.execute(text("""
+            SELECT column_name FROM information_schema.columns WHERE table_name = 'employees'
+        """))}
+        conn.execute(text("SET LOCAL lock_timeout = '5s'"))
+        for name, sql_type in (("payload", "BYTEA"), ("generation_id", "INTEGER")):
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE employees ADD COLUMN IF NOT EXISTS {name} {sql_type}"))
+        if conn.execute(text("SELECT to_regclass('ix_employees_generation_id')")).scalar() is None:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_employees_generation_id ON employees (generation_id)"))
+    db = SessionLocal()
+    try:
+        adopt_legacy_rows(db)
+    except Exception:
+        logger.exception("Error adoptando filas previas a las generaciones")
+    finally:
+        db.close()
+    # En segundo plano: en tablas grandes no debe demorar el arranque
+    threading.Thread(target=ensure_history_index, daemon=True).start()
 
 # ====== FastAPI ======
-app = FastAPI(title="Resemin App Backend", version="1.9.1")
+app = FastAPI(
+    title="Resemin App Backend",
+    version="1.9.1",
+    default_response_class=ORJSONResponse if orjson is not None else JSONResponse,
+)
 
 # ====== CORS ======
 ALLOWED_ORIGINS = [
@@ -89,6 +145,87 @@ async def log_requests(request: Request, call_next):
         logger.exception("Excepción durante request")
         raise
 
+# ====== Queries lentas (EXPLAIN automático) ======
+slow_queries = deque(maxlen=SLOW_QUERY_BUFFER)  # ring buffer de las más recientes
+slow_queries_lock = threading.Lock()
+explain_executor = ThreadPoolExecutor(max_workers=1)  # un EXPLAIN a la vez, fuera del request
+explain_slot = threading.Semaphore(1)  # como máximo un EXPLAIN pendiente o en curso
+SQL_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+def params_shape(params):
+    """Tipos de los parámetros, sin sus valores (los DNI no deben quedar en logs)."""
+    if isinstance(params, dict):
+        return {str(k): type(v).__name__ for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        if params and isinstance(params[0], (dict, list, tuple)):  # executemany
+            return {"executemany": len(params), "first": params_shape(params[0])}
+        return [type(v).__name__ for v in params]
+    return type(params).__name__
+
+def explainable(statement: str) -> bool:
+    """
+    ANALYZE ejecuta la sentencia de verdad: solo se re-ejecutan las lecturas sobre
+    employees. Se excluyen los locks (FOR UPDATE/SHARE) y las llamadas a funciones
+    pg_* (p.ej. pg_advisory_lock, que dejaría el lock tomado en la conexión del pool).
+    """
+    sql = " ".join(statement.split()).upper()
+    return (
+        sql.startswith("SELECT ")
+        and " FROM EMPLOYEES" in sql
+        and " FOR UPDATE" not in sql
+        and " FOR SHARE" not in sql
+        and " FOR NO KEY UPDATE" not in sql
+        and " FOR KEY SHARE" not in sql
+        and "PG_" not in sql
+    )
+
+def redact_literals(sql: str) -> str:
+    """psycopg2 interpola los parámetros en el cliente: se ocultan los literales de texto."""
+    return SQL_STRING_LITERAL.sub("'?'", sql)
+
+def explain_query(entry: dict, statement: str, parameters):
+    """Re-ejecuta la query con EXPLAIN (ANALYZE, BUFFERS) y guarda el plan (redactado) en la entrada."""
+    try:
+        with engine.connect() as conn:
+            plan = conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters).fetchall()
+            conn.rollback()
+        entry["plan"] = redact_literals("\n".join(r[0] for r in plan))
+    except Exception as e:
+        entry["plan_error"] = redact_literals(str(e))
+    finally:
+        explain_slot.release()
+
+if engine is not None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _query_start(conn, cursor, statement, parameters, context, executemany):
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _query_end(conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_query_start", None)
+        if start is None:
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if elapsed_ms < SLOW_QUERY_MS or statement.lstrip().upper().startswith("EXPLAIN"):
+            return
+        entry = {
+            "statement": statement.strip(),
+            "params": params_shape(parameters),
+            "duration_ms": round(elapsed_ms, 1),
+            "at": datetime.utcnow().isoformat(),
+            "plan": None,
+        }
+        logger.warning(f"Query lenta ({entry['duration_ms']} ms) params={entry['params']}: {entry['statement'][:300]}")
+        with slow_queries_lock:
+            slow_queries.append(entry)
+        # Si ya hay un EXPLAIN pendiente se omite: con la BD degradada no se acumula cola
+        if explainable(statement) and not executemany and random.random() < SLOW_QUERY_EXPLAIN_RATE:
+            if explain_slot.acquire(blocking=False):
+                try:
+                    explain_executor.submit(explain_query, entry, statement, parameters)
+                except RuntimeError:  # executor cerrado (apagado del proceso)
+                    explain_slot.release()
+
 # ====== DB Session helper ======
 def get_db() -> Session:
     if SessionLocal is None:
@@ -156,6 +293,107 @@ def normalize_row(row_dict: dict) -> dict:
         out[str(k)] = to_json_scalar(v)
     return out
 
+# ====== Payloads pre-codificados y compresión ======
+def dumps_bytes(obj) -> bytes:
+    """Serializa a JSON compacto (bytes). Usa orjson si está instalado."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def build_payload(data: dict, visibles: List[str]) -> bytes:
+    """
+    Codifica las columnas visibles de una fila. Los datos ya vienen normalizados
+    desde normalize_row (ingesta), así que no se vuelve a pasar por to_json_scalar.
+    """
+    return dumps_bytes({k: data.get(k) for k in visibles})
+
+def row_payload(stored, data: Optional[dict], visibles: List[str]) -> bytes:
+    """Devuelve el payload guardado o lo calcula si la fila aún no lo tiene."""
+    if stored is not None:
+        return bytes(stored)  # psycopg2 devuelve BYTEA como memoryview
+    return build_payload(data or {}, visibles)
+
+PAYLOADS_LOCK_ID = 72711  # clave de pg_advisory_xact_lock para recalcular payloads
+PAYLOADS_BATCH = 1000
+
+def rebuild_payloads():
+    """
+    Recalcula en segundo plano los payloads de la generación activa con las visibles
+    de la config vigente (leída dentro del lock, así gana siempre la última). Se
+    procesa por lotes de id; hasta el commit las consultas ven payload_visibles
+    distinto a la config y codifican al vuelo. Los errores solo se registran.
+    """
+    if SessionLocal is None:
+        return
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": PAYLOADS_LOCK_ID})
+        cfg = get_config(db)
+        gen = get_active_generation(db)
+        if not cfg or not gen or gen.payload_visibles == cfg["visibles"]:
+            db.rollback()
+            return
+        visibles = cfg["visibles"]
+        last_id = 0
+        while True:
+            batch = (
+                db.query(Employee.id, Employee.data)
+                .filter(Employee.generation_id == gen.id, Employee.id > last_id)
+                .order_by(Employee.id)
+                .limit(PAYLOADS_BATCH)
+                .all()
+            )
+            if not batch:
+                break
+            db.bulk_update_mappings(
+                Employee,
+                [{"id": emp_id, "payload": build_payload(data or {}, visibles)} for emp_id, data in batch],
+            )
+            last_id = batch[-1][0]
+        gen.payload_visibles = visibles
+        db.commit()
+    except Exception:
+        db.rollback()
+        logger.exception("Error recalculando payloads")
+    finally:
+        db.close()
+
+def json_array(parts: List[bytes]) -> bytes:
+    return b"[" + b",".join(parts) + b"]"
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Elige 'br' o 'gzip' según Accept-Encoding (respeta q=0)."""
+    accepted = {}
+    for token in (accept_encoding or "").split(","):
+        name, _, params = token.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+def fast_json_response(request: Request, body: bytes) -> Response:
+    """Respuesta JSON a partir de bytes ya codificados, comprimida si es grande."""
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding", ""))
+        if encoding == "br":
+            body = brotli.compress(body, quality=5)
+            headers["Content-Encoding"] = "br"
+        elif encoding == "gzip":
+            body = gzip.compress(body, compresslevel=6)
+            headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # ====== Seguridad Admin ======
 def check_admin(user: Optional[str], pwd: Optional[str]):
     if not ADMIN_PASSWORD or not ADMIN_USER:
@@ -177,7 +415,170 @@ def get_meta(db: Session, key: str) -> Optional[str]:
     entry = db.query(MetaEntry).filter(MetaEntry.key == key).first()
     return entry.value if entry else None
 
+# ====== Generaciones de datos (cada upload es inmutable) ======
+def get_active_generation(db: Session) -> Optional[DatasetGeneration]:
+    val = get_meta(db, "active_generation")
+    if not val:
+        return None
+    try:
+        return db.query(DatasetGeneration).filter(DatasetGeneration.id == int(val)).first()
+    except ValueError:
+        return None
+
+def lock_active_generation(db: Session) -> Optional[int]:
+    """
+    Bloquea (FOR UPDATE) el puntero de generación activa hasta el commit/rollback,
+    para que activar y podar no se pisen. Devuelve el id activo.
+    """
+    entry = db.query(MetaEntry).filter(MetaEntry.key == "active_generation").with_for_update().first()
+    try:
+        return int(entry.value) if entry and entry.value else None
+    except ValueError:
+        return None
+
+def set_active_generation(db: Session, gen: DatasetGeneration):
+    """Activar es solo cambiar un puntero en meta: O(1), sin re-ingesta."""
+    set_meta(db, "active_generation", str(gen.id))
+
+def generation_info(gen: DatasetGeneration, active_id: Optional[int] = None) -> dict:
+    return {
+        "id": gen.id,
+        "file_name": gen.file_name,
+        "rows": gen.rows,
+        "columns": gen.columns or [],
+        "checksum": gen.checksum,
+        "created_at": gen.created_at.isoformat() if gen.created_at else None,
+        "active": gen.id == active_id,
+    }
+
+ADOPT_LOCK_ID = 72712  # clave de pg_advisory_xact_lock para adoptar filas previas
+
+def adopt_legacy_rows(db: Session):
+    """
+    Agrupa las filas cargadas antes de existir generaciones en una generación propia.
+    Corre al importar en cada worker: el advisory lock hace que solo uno adopte y los
+    demás, al volver a contar dentro del lock, no encuentren filas pendientes.
+    """
+    db.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": ADOPT_LOCK_ID})
+    count = db.query(Employee).filter(Employee.generation_id.is_(None)).count()
+    if not count:
+        db.rollback()  # no dejar la sesión idle en transacción con lock sobre employees
+        return
+    cols = get_meta(db, "columns")
+    # Si las filas ya tienen payloads, se construyeron con las visibles de la config vigente
+    cfg = get_config(db)
+    has_payloads = db.query(Employee.id).filter(
+        Employee.generation_id.is_(None), Employee.payload.isnot(None)
+    ).first() is not None
+    gen = DatasetGeneration(
+        file_name="(carga previa)",
+        rows=count,
+        columns=json.loads(cols) if cols else [],
+        checksum=None,
+        payload_visibles=cfg["visibles"] if cfg and has_payloads else None,
+    )
+    db.add(gen)
+    db.flush()
+    gen.rows = db.query(Employee).filter(Employee.generation_id.is_(None)).update(
+        {Employee.generation_id: gen.id}, synchronize_session=False
+    )
+    # Todo en la misma transacción (y bajo el lock): set_meta hace el commit
+    if get_active_generation(db) is None:
+        set_active_generation(db, gen)
+    else:
+        db.commit()
+
+def prune_generations(keep: int = GENERATIONS_KEEP):
+    """Borra las generaciones más antiguas (nunca la activa). Se ejecuta en segundo plano."""
+    if SessionLocal is None:
+        return
+    db = SessionLocal()
+    try:
+        # El puntero queda bloqueado hasta el commit: nadie activa una generación a medio borrar
+        active_id = lock_active_generation(db)
+        ids = [g.id for g in db.query(DatasetGeneration.id).order_by(DatasetGeneration.id.desc())]
+        stale = [i for i in ids[keep:] if i != active_id]
+        if not stale:
+            db.rollback()
+            return
+        db.query(Employee).filter(Employee.generation_id.in_(stale)).delete(synchronize_session=False)
+        db.query(DatasetGeneration).filter(DatasetGeneration.id.in_(stale)).delete(synchronize_session=False)
+        db.commit()
+        logger.info(f"Generaciones eliminadas por retención: {stale}")
+    except Exception:
+        db.rollback()
+        logger.exception("Error podando generaciones")
+    finally:
+        db.close()
+
+# ====== Historial por DNI (índice + cursor keyset) ======
+HISTORY_INDEX_LOCK_ID = 72710  # clave de pg_advisory_lock para construir el índice
+
+def history_index_valid(conn) -> bool:
+    """True si ix_employees_dni_history existe y no quedó INVALID (build CONCURRENTLY fallido)."""
+    row = conn.execute(text("""
+        SELECT i.indisvalid
+        FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname = 'ix_employees_dni_history'
+    """)).first()
+    return bool(row and row[0])
+
+def ensure_history_index():
+    """
+    Índice de expresión para buscar por DNI ordenado por fecha. Las columnas las
+    elige el admin, así que se recrea (CONCURRENTLY) solo cuando cambian o si quedó
+    inválido. Corre en segundo plano; un advisory lock evita que varios workers lo
+    construyan a la vez, y se lee la config dentro del lock para construir siempre
+    la última. Los errores solo se registran en el log.
+    """
+    if engine is None:
+        return
+    db = SessionLocal()
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": HISTORY_INDEX_LOCK_ID})
+            try:
+                cfg = get_config(db)
+                current = get_meta(db, "history_index")
+                # CONCURRENTLY espera a toda transacción con lock en employees, incluida esta sesión
+                db.rollback()
+                if not cfg:
+                    return
+                dni_col, fecha_col = cfg["dni"], cfg["fecha"]
+                wanted = json.dumps([dni_col, fecha_col], ensure_ascii=False)
+                if current == wanted and history_index_valid(conn):
+                    return
+                conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS ix_employees_dni_history"))
+                conn.execute(text(f"""
+                    CREATE INDEX CONCURRENTLY ix_employees_dni_history
+                    ON employees (generation_id, (data->>'{dni_col}'), (COALESCE(data->>'{fecha_col}', '')), id)
+                """))
+                set_meta(db, "history_index", wanted)
+                logger.info(f"Índice de historial construido para {wanted}")
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": HISTORY_INDEX_LOCK_ID})
+    except Exception:
+        db.rollback()
+        logger.exception("Error construyendo índice de historial")
+    finally:
+        db.close()
+
+def encode_cursor(fecha: str, emp_id: int) -> str:
+    raw = json.dumps([fecha, emp_id], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str):
+    """Devuelve (fecha, id) del último registro de la página anterior."""
+    try:
+        fecha, emp_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(fecha), int(emp_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
 def get_last_columns(db: Session) -> List[str]:
+    gen = get_active_generation(db)
+    if gen and isinstance(gen.columns, list):
+        return [str(c) for c in gen.columns]
     val = get_meta(db, "columns")
     if val:
         try:
@@ -202,14 +603,14 @@ def get_config(db: Session):
     visibles = cfg.visibles if isinstance(cfg.visibles, list) else []
     return {"dni": cfg.dni, "fecha": cfg.fecha, "visibles": visibles}
 
-def validate_columns_exist(dni_col: str, fecha_col: str, visibles: List[str], available: List[str]):
+def validate_columns_exist(dni_col: str, fecha_col: str, visibles: List[str], available: List[str], status_code: int = 400):
     missing = []
     for name in [dni_col, fecha_col] + (visibles or []):
         if name and name not in available:
             missing.append(name)
     if missing:
         raise HTTPException(
-            status_code=400,
+            status_code=status_code,
             detail={
                 "error": "Columnas no encontradas en el Excel cargado",
                 "faltantes": missing,
@@ -248,12 +649,14 @@ def admin_login(
 # ====== ADMIN: Upload ======
 @app.post("/admin/upload")
 async def admin_upload(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     x_admin_user: Optional[str] = Header(None, alias="X-Admin-User"),
     x_admin_password: Optional[str] = Header(None, alias="X-Admin-Password"),
 ):
     check_admin(x_admin_user, x_admin_password)
     contents = await file.read()
+    checksum = hashlib.sha256(contents).hexdigest()
     bio = BytesIO(contents)
 
     # Lee .xlsx preferentemente, cae a autodetección si falla
@@ -271,19 +674,33 @@ async def admin_upload(
 
     db = get_db()
     try:
-        # "Último Excel manda": limpiar empleados previos
-        db.query(Employee).delete()
-        db.commit()
+        # Si la config vigente aplica al nuevo Excel, precalcula los payloads
+        cfg = get_config(db)
+        visibles = cfg["visibles"] if cfg and all(c in columns for c in cfg["visibles"]) else None
+
+        # "Último Excel manda", pero sin borrar: cada upload es una generación nueva
+        gen = DatasetGeneration(
+            file_name=file.filename,
+            rows=len(rows),
+            columns=columns,
+            checksum=checksum,
+            payload_visibles=visibles,
+        )
+        db.add(gen)
+        db.flush()
 
         # Insertar filas
         for r in rows:
-            db.add(Employee(data=r))
+            payload = build_payload(r, visibles) if visibles else None
+            db.add(Employee(data=r, payload=payload, generation_id=gen.id))
         db.commit()
 
-        # Guardar meta: columnas
+        # Guardar meta: columnas y generación activa
         set_meta(db, "columns", json.dumps(columns, ensure_ascii=False))
+        set_active_generation(db, gen)
 
-        return {"columns": columns, "rows": len(rows)}
+        background_tasks.add_task(prune_generations)
+        return {"columns": columns, "rows": len(rows), "generation": gen.id}
     finally:
         db.close()
 
@@ -295,6 +712,7 @@ class ConfigPayload(BaseModel):
 
 @app.post("/admin/config")
 def admin_config(
+    background_tasks: BackgroundTasks,
     payload: ConfigPayload = Body(..., media_type="application/json"),
     x_admin_user: Optional[str] = Header(None, alias="X-Admin-User"),
     x_admin_password: Optional[str] = Header(None, alias="X-Admin-Password"),
@@ -326,6 +744,9 @@ def admin_config(
             cfg.visibles = visible_columns
         db.commit()
 
+        background_tasks.add_task(rebuild_payloads)
+        background_tasks.add_task(ensure_history_index)
+
         return {"ok": True, "dni_column": dni_column, "fecha_column": fecha_column, "visible_columns": visible_columns}
     finally:
         db.close()
@@ -338,15 +759,70 @@ def admin_status(
     check_admin(x_admin_user, x_admin_password)
     db = get_db()
     try:
-        employees_count = db.query(Employee).count()
+        gen = get_active_generation(db)
         cfg = get_config(db)
-        return {"employees": employees_count, "config": cfg}
+        return {"employees": gen.rows if gen else 0, "generation": gen.id if gen else None, "config": cfg}
+    finally:
+        db.close()
+
+@app.get("/admin/slow-queries")
+def admin_slow_queries(
+    limit: int = Query(20, ge=1, le=SLOW_QUERY_BUFFER),
+    x_admin_user: Optional[str] = Header(None, alias="X-Admin-User"),
+    x_admin_password: Optional[str] = Header(None, alias="X-Admin-Password"),
+):
+    """Peores queries lentas recientes (mayor duración primero), con plan si se muestreó."""
+    check_admin(x_admin_user, x_admin_password)
+    with slow_queries_lock:
+        entries = [dict(e) for e in slow_queries]
+    entries.sort(key=lambda e: e["duration_ms"], reverse=True)
+    return {
+        "threshold_ms": SLOW_QUERY_MS,
+        "explain_rate": SLOW_QUERY_EXPLAIN_RATE,
+        "queries": entries[:limit],
+    }
+
+@app.get("/admin/generations")
+def admin_generations(
+    x_admin_user: Optional[str] = Header(None, alias="X-Admin-User"),
+    x_admin_password: Optional[str] = Header(None, alias="X-Admin-Password"),
+):
+    check_admin(x_admin_user, x_admin_password)
+    db = get_db()
+    try:
+        active = get_active_generation(db)
+        active_id = active.id if active else None
+        gens = db.query(DatasetGeneration).order_by(DatasetGeneration.id.desc()).all()
+        return {"active": active_id, "generations": [generation_info(g, active_id) for g in gens]}
+    finally:
+        db.close()
+
+@app.post("/admin/generations/{generation_id}/activate")
+def admin_activate_generation(
+    generation_id: int,
+    x_admin_user: Optional[str] = Header(None, alias="X-Admin-User"),
+    x_admin_password: Optional[str] = Header(None, alias="X-Admin-Password"),
+):
+    """Rollback instantáneo: apunta las consultas a una generación previa."""
+    check_admin(x_admin_user, x_admin_password)
+    db = get_db()
+    try:
+        lock_active_generation(db)  # serializa con prune_generations
+        gen = db.query(DatasetGeneration).filter(DatasetGeneration.id == generation_id).first()
+        if not gen:
+            raise HTTPException(status_code=404, detail="Generación no encontrada")
+        # La config vigente debe aplicar a esa generación, si no las consultas darían 400
+        cfg = get_config(db)
+        if cfg:
+            validate_columns_exist(cfg["dni"], cfg["fecha"], cfg["visibles"], gen.columns or [], status_code=409)
+        set_active_generation(db, gen)
+        return {"ok": True, "generation": generation_info(gen, gen.id)}
     finally:
         db.close()
 
 # ====== Públicos ======
 @app.post("/consulta")
-def consulta(item: dict):
+def consulta(item: dict, request: Request):
     """
     Consulta pública usando POST. Devuelve lista de coincidencias (varios periodos).
     Filtra por DNI y por la columna configurada como Fecha (usa parse_input_date).
@@ -360,6 +836,11 @@ def consulta(item: dict):
 
         available = get_last_columns(db)
         validate_columns_exist(dni_col, fecha_col, visibles, available)
+        gen = get_active_generation(db)
+        if not gen:
+            raise HTTPException(status_code=409, detail="No hay datos cargados")
+        # Payloads guardados solo valen si se generaron con las visibles actuales
+        use_stored = gen.payload_visibles == visibles
 
         # Normaliza la fecha del payload (acepta DD/MM/YYYY o ISO)
         req_dni = str(item.get("dni", "")).strip()
@@ -367,19 +848,17 @@ def consulta(item: dict):
 
         # Consulta eficiente en JSONB (PostgreSQL/Supabase)
         sql = text(f"""
-            SELECT data
+            SELECT payload, data
             FROM employees
-            WHERE data->>'{dni_col}' = :dni
+            WHERE generation_id = :gen
+              AND data->>'{dni_col}' = :dni
               AND data->>'{fecha_col}' = :fecha
         """)
-        rows = db.execute(sql, {"dni": req_dni, "fecha": req_fecha}).fetchall()
+        rows = db.execute(sql, {"gen": gen.id, "dni": req_dni, "fecha": req_fecha}).fetchall()
 
-        res = []
-        for row in rows:
-            data = row[0] or {}
-            res.append({k: to_json_scalar(data.get(k)) for k in visibles})
+        res = [row_payload(row[0] if use_stored else None, row[1], visibles) for row in rows]
 
-        return {"results": res}
+        return fast_json_response(request, b'{"results":' + json_array(res) + b"}")
     finally:
         db.close()
 
@@ -395,7 +874,7 @@ def public_columns():
         db.close()
 
 @app.get("/public/query")
-def public_query(dni: str = Query(...), fecha: str = Query(...)):
+def public_query(request: Request, dni: str = Query(...), fecha: str = Query(...)):
     """
     Consulta pública usando GET (parámetros en URL). Devuelve lista de coincidencias (varios periodos).
     Filtra por DNI y por la columna configurada como Fecha (usa parse_input_date).
@@ -409,6 +888,11 @@ def public_query(dni: str = Query(...), fecha: str = Query(...)):
 
         available = get_last_columns(db)
         validate_columns_exist(dni_col, fecha_col, visibles, available)
+        gen = get_active_generation(db)
+        if not gen:
+            return {"found": False, "message": "No hay datos cargados"}
+        # Payloads guardados solo valen si se generaron con las visibles actuales
+        use_stored = gen.payload_visibles == visibles
 
         # Normaliza fecha del query param
         req_dni = str(dni).strip()
@@ -416,22 +900,20 @@ def public_query(dni: str = Query(...), fecha: str = Query(...)):
 
         # Consulta eficiente en JSONB (PostgreSQL/Supabase)
         sql = text(f"""
-            SELECT data
+            SELECT payload, data
             FROM employees
-            WHERE data->>'{dni_col}' = :dni
+            WHERE generation_id = :gen
+              AND data->>'{dni_col}' = :dni
               AND data->>'{fecha_col}' = :fecha
         """)
-        rows = db.execute(sql, {"dni": req_dni, "fecha": req_fecha}).fetchall()
+        rows = db.execute(sql, {"gen": gen.id, "dni": req_dni, "fecha": req_fecha}).fetchall()
 
-        matches = []
-        for row in rows:
-            data = row[0] or {}
-            matches.append({k: to_json_scalar(data.get(k)) for k in visibles})
+        matches = [row_payload(row[0] if use_stored else None, row[1], visibles) for row in rows]
 
         if matches:
             # Compatibilidad: además de 'results', exponemos 'data' como el primer elemento
-            first = matches[0]
-            return {"found": True, "data": first, "results": matches}
+            body = b'{"found":true,"data":' + matches[0] + b',"results":' + json_array(matches) + b"}"
+            return fast_json_response(request, body)
         else:
             return {"found": False, "message": "No se encontró registro para ese DNI y fecha"}
     except HTTPException as he:
@@ -440,3 +922,61 @@ def public_query(dni: str = Query(...), fecha: str = Query(...)):
         return {"found": False, "message": f"Error interno: {str(e)}"}
     finally:
         db.close()
+
+@app.get("/public/history")
+def public_history(
+    request: Request,
+    dni: str = Query(...),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(20, ge=1, le=100),
+):
+    """
+    Historial público: todos los periodos de un DNI, del más reciente al más antiguo
+    según la columna Fecha configurada. Paginado por cursor (keyset), no OFFSET:
+    usar 'next_cursor' de la respuesta para pedir la página siguiente.
+    """
+    db = get_db()
+    try:
+        cfg = get_config(db)
+        if not cfg:
+            return {"found": False, "message": "No hay configuración guardada"}
+        dni_col = cfg["dni"]; fecha_col = cfg["fecha"]; visibles = cfg["visibles"]
+
+        available = get_last_columns(db)
+        validate_columns_exist(dni_col, fecha_col, visibles, available)
+        gen = get_active_generation(db)
+        if not gen:
+            return {"found": False, "message": "No hay datos cargados"}
+        use_stored = gen.payload_visibles == visibles
+
+        params = {"gen": gen.id, "dni": str(dni).strip(), "limit": limit + 1}
+        after = ""
+        if cursor:
+            params["cur_fecha"], params["cur_id"] = decode_cursor(cursor)
+            after = f"AND (COALESCE(data->>'{fecha_col}', ''), id) < (:cur_fecha, :cur_id)"
+
+        # Mismo orden que ix_employees_dni_history: la página sale del índice
+        sql = text(f"""
+            SELECT payload, data, id, COALESCE(data->>'{fecha_col}', '') AS sort_fecha
+            FROM employees
+            WHERE generation_id = :gen
+              AND data->>'{dni_col}' = :dni
+              {after}
+            ORDER BY COALESCE(data->>'{fecha_col}', '') DESC, id DESC
+            LIMIT :limit
+        """)
+        rows = db.execute(sql, params).fetchall()
+
+        if not rows and not cursor:
+            return {"found": False, "message": "No se encontraron registros para ese DNI"}
+
+        page = rows[:limit]
+        next_cursor = encode_cursor(page[-1][3], page[-1][2]) if len(rows) > limit else None
+        results = [row_payload(row[0] if use_stored else None, row[1], visibles) for row in page]
+        body = (
+            b'{"found":true,"results":' + json_array(results)
+            + b',"next_cursor":' + dumps_bytes(next_cursor) + b"}"
+        )
+        return fast_json_response(request, body)
+    finally:
+        db.close()
@@ -217,6 +217,71 @@ async function consultarSubmit(ev) {
   }
 }
 
+// ==== Historial completo por DNI (paginado por cursor) ====
+let HISTORIAL = { dni: null, cursor: null, results: [] };
+
+async function fetchHistorial(dni, cursor) {
+  const url = new URL(`${API}/public/history`);
+  url.searchParams.set("dni", dni);
+  if (cursor) url.searchParams.set("cursor", cursor);
+
+  const res = await fetch(url, { headers: { "Accept": "application/json" }});
+  if (!res.ok) { const txt = await res.text(); throw new Error(`HTTP ${res.status}: ${txt}`); }
+  return res.json();
+}
+
+async function historialClick() {
+  const dni = document.getElementById("dni")?.value.trim();
+  const alertBox = document.getElementById("consulta-alert");
+  const resultBox = document.getElementById("resultado");
+  if (!alertBox || !resultBox) return;
+
+  hideAlert(alertBox);
+  resultBox.innerHTML = "";
+  if (!dni) { showAlert(alertBox, "warning", "Completa el DNI."); return; }
+
+  try {
+    showAlert(alertBox, "info", "Consultando historial...");
+    const data = await fetchHistorial(dni, null);
+
+    if (!data.found) { showAlert(alertBox, "danger", data.message || "No encontrado"); return; }
+    hideAlert(alertBox);
+
+    HISTORIAL = { dni, cursor: data.next_cursor, results: data.results || [] };
+    renderHistorial();
+  } catch (e) {
+    showAlert(alertBox, "danger", `Error: ${e.message}`);
+  }
+}
+
+async function historialMas(ev) {
+  const btn = ev.currentTarget;
+  const alertBox = document.getElementById("consulta-alert");
+  btn.disabled = true;
+  try {
+    const data = await fetchHistorial(HISTORIAL.dni, HISTORIAL.cursor);
+    HISTORIAL.results = HISTORIAL.results.concat(data.results || []);
+    HISTORIAL.cursor = data.next_cursor;
+    renderHistorial();
+  } catch (e) {
+    btn.disabled = false;
+    if (alertBox) showAlert(alertBox, "danger", `Error: ${e.message}`);
+  }
+}
+
+function renderHistorial() {
+  renderResultado({ results: HISTORIAL.results });
+  if (!HISTORIAL.cursor) return;
+
+  const contenedor = document.getElementById('resultado');
+  contenedor.insertAdjacentHTML('beforeend', `
+    <button id="btn-historial-mas" type="button" class="btn btn-outline-primary w-100 mt-3">
+      Cargar más periodos
+    </button>
+  `);
+  document.getElementById("btn-historial-mas").addEventListener("click", historialMas);
+}
+
 // ==== Render resultado (múltiples periodos) ====
 
 function renderResultado(data) {
@@ -301,6 +366,7 @@ document.addEventListener("DOMContentLoaded", () => {
   document.getElementById("btn-clear-all")?.addEventListener("click", clearAll);
 
   document.getElementById("consulta-form")?.addEventListener("submit", consultarSubmit);
+  document.getElementById("btn-historial")?.addEventListener("click", historialClick);
 
   if (ADMIN) {
     const panel = document.getElementById("admin-panel");